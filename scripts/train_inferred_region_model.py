@@ -7,13 +7,18 @@ Usage:
       --input ask2ask_visits.ndjson \
       --output Models/ \
       --test-size 0.2 \
-      --num-rounds 100
+      --num-rounds 100 \
+      --chunk-size 100000
 """
 
 import argparse
 import json
 import logging
+import os
+import re
 import sys
+from collections.abc import Iterable, Iterator
+from itertools import islice
 from pathlib import Path
 
 import numpy as np
@@ -21,15 +26,25 @@ import pandas as pd
 
 try:
     import lightgbm as lgb
+    import onnx
     import onnxmltools
-    from sklearn.model_selection import train_test_split
-    from sklearn.preprocessing import LabelEncoder
+    from sklearn.model_selection import StratifiedShuffleSplit
     from sklearn.metrics import accuracy_score, top_k_accuracy_score
 except ImportError as e:
     print(f"Missing required package: {e}")
     print("Install with: pip install lightgbm onnxmltools scikit-learn pandas numpy")
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -47,6 +62,99 @@ REGION_DEFINITIONS = {
     'ap-tok': {'name': 'Tokyo Metro', 'country': 'JP', 'lat': 35.6762, 'lon': 139.6503},
 }
 
+FEATURE_COUNT = 10
+
+# VPN suspicion level -> feature value (SuspicionLevel switch in OnnxInferredRegionEngine.cs)
+_SUSPICION_MAP = {'high': 1.0, 'medium': 0.5, 'low': 0.25}
+
+# ai.onnx opset for the exported model (highest the onnxmltools converter supports)
+ONNX_TARGET_OPSET = 15
+
+# NDJSON lines parsed per chunk when streaming the export
+CHUNK_SIZE = 100_000
+
+# CPUs this process may run on (respects affinity/cpusets, unlike os.cpu_count())
+if hasattr(os, 'sched_getaffinity'):
+    CPU_COUNT = len(os.sched_getaffinity(0))
+else:
+    CPU_COUNT = os.cpu_count() or 1
+
+# Nested objects in the export that are flattened into dotted columns, with the
+# defaults build_features() applies when a key is absent (explicit nulls stay null)
+NESTED_COLUMNS = {
+    'asn_correlation': {},
+    'vpn_detection': {'suspicion_level': 'low'},
+}
+
+# Above this many regions the (N, R) distance matrix is replaced by a
+# streaming Numba kernel (when numba is installed)
+NUMBA_REGION_THRESHOLD = 100
+
+# Max distance (degrees) for a GPS fix to be assigned to a region
+MAX_REGION_DISTANCE = 100
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    """Return a column, or an all-missing Series if the export lacks it"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def _string_column(df: pd.DataFrame, name: str) -> pd.Series:
+    """Return a column as pandas string dtype (all-missing chunks come back as float)"""
+    return _column(df, name).astype('string')
+
+
+def _numeric_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    """Return a column as float32, treating missing values as 0"""
+    return pd.to_numeric(_column(df, name), errors='coerce').fillna(0).to_numpy(np.float32)
+
+
+# Compiled lazily by _get_nearest_region_kernel(); only needed for large region sets
+_nearest_region_kernel = None
+
+
+def _get_nearest_region_kernel():
+    """Compile the Numba nearest-region kernel on first use (None without numba)"""
+    global _nearest_region_kernel
+    if _nearest_region_kernel is not None:
+        return _nearest_region_kernel
+
+    try:
+        import numba as nb
+    except ImportError:
+        return None
+
+    @nb.njit(parallel=True, fastmath=True, cache=True)
+    def kernel(lats, lons, region_lat, region_lon, max_d2):
+        """Index of the nearest region per point (-1 if none within max_d2)"""
+        out = np.full(lats.shape[0], -1, np.int32)
+        for i in nb.prange(lats.shape[0]):
+            best = max_d2
+            best_idx = -1
+            for j in range(region_lat.shape[0]):
+                d2 = (lats[i] - region_lat[j]) ** 2 + (lons[i] - region_lon[j]) ** 2
+                if d2 < best:
+                    best = d2
+                    best_idx = j
+            out[i] = best_idx
+        return out
+
+    _nearest_region_kernel = kernel
+    return kernel
+
+class RegionLabelEncoder:
+    """
+    Fixed label encoding over REGION_DEFINITIONS.
+    Class indices are stable across training runs (ONNX class -> region mapping).
+    """
+
+    def __init__(self):
+        self.classes_ = np.array(sorted(REGION_DEFINITIONS))
+
+    def transform(self, labels) -> np.ndarray:
+        return pd.Categorical(labels, categories=self.classes_).codes.astype(np.int32)
+
 class ModelTrainer:
     """Train and export ONNX region classification model"""
 
@@ -54,25 +162,77 @@ class ModelTrainer:
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.label_encoder = None
+        self.model_variants = {}
+        self.invalid_records = 0
 
-    def load_data(self, input_file: str) -> pd.DataFrame:
-        """Load NDJSON export from Ask2Ask API"""
-        logger.info(f"Loading data from {input_file}")
-        records = []
+        # Region centroids as arrays for batch_nearest_region()
+        self._region_ids = np.array(list(REGION_DEFINITIONS.keys()), dtype=object)
+        self._region_lat = np.array([m['lat'] for m in REGION_DEFINITIONS.values()])
+        self._region_lon = np.array([m['lon'] for m in REGION_DEFINITIONS.values()])
 
-        with open(input_file, 'r') as f:
-            for line in f:
+        # City name -> region lookups for find_region_by_city()
+        self._city_to_region = {}
+        for region_id, meta in REGION_DEFINITIONS.items():
+            name = meta['name'].lower()
+            self._city_to_region[name] = region_id
+            self._city_to_region[name.removesuffix(' metro')] = region_id
+        self._city_pattern = re.compile(
+            r'\b(' + '|'.join(
+                re.escape(key) for key in sorted(self._city_to_region, key=len, reverse=True)
+            ) + r')\b'
+        )
+
+    def iter_data(self, input_file: str, chunksize: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Stream the NDJSON export as DataFrame chunks of at most `chunksize` lines"""
+        logger.info(f"Streaming data from {input_file} in chunks of {chunksize}")
+        self.invalid_records = 0
+        lines_read = 0
+
+        try:
+            with pd.read_json(
+                input_file, lines=True, dtype=False, convert_dates=False, chunksize=chunksize
+            ) as reader:
+                for chunk in reader:
+                    lines_read += chunksize
+                    yield chunk
+        except ValueError as e:
+            # Resume after the chunks already yielded, skipping bad records
+            logger.warning(f"Malformed NDJSON ({e}), falling back to line-by-line parsing")
+            records = []
+            for record in self.iter_records(input_file, skip_lines=lines_read):
+                records.append(record)
+                if len(records) == chunksize:
+                    yield pd.DataFrame(records)
+                    records = []
+            if records:
+                yield pd.DataFrame(records)
+
+    def iter_records(self, input_file: str, skip_lines: int = 0) -> Iterator[dict]:
+        """Parse NDJSON line by line, skipping (and counting) invalid records"""
+        loads = orjson.loads if orjson else json.loads
+        decode_error = orjson.JSONDecodeError if orjson else json.JSONDecodeError
+
+        with open(input_file, 'rb') as f:
+            for line in islice(f, skip_lines, None):
                 if not line.strip():
                     continue
                 try:
-                    record = json.loads(line)
-                    records.append(record)
-                except json.JSONDecodeError as e:
+                    yield loads(line)
+                except decode_error as e:
+                    self.invalid_records += 1
                     logger.warning(f"Skipping invalid JSON: {e}")
-                    continue
 
-        df = pd.DataFrame(records)
-        logger.info(f"Loaded {len(df)} records")
+    @staticmethod
+    def flatten_nested(df: pd.DataFrame) -> pd.DataFrame:
+        """Flatten nested correlation/VPN objects into dotted columns (e.g. 'vpn_detection.suspicion_level')"""
+        for parent, defaults in NESTED_COLUMNS.items():
+            values = df[parent] if parent in df.columns else [None] * len(df)
+            nested = pd.json_normalize([
+                {**defaults, **value} if isinstance(value, dict) else dict(defaults)
+                for value in values
+            ])
+            nested.index = df.index
+            df = df.drop(columns=parent, errors='ignore').join(nested.add_prefix(f'{parent}.'))
         return df
 
     def extract_label(self, row: dict) -> str:
@@ -110,15 +270,69 @@ class ModelTrainer:
                 best_distance = distance
                 best_region = region_id
 
-        return best_region if best_distance < 100 else None  # Max ~10° (~1000km)
+        return best_region if best_distance < MAX_REGION_DISTANCE else None  # Max ~10° (~1000km)
+
+    def batch_nearest_region(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Vectorized nearest_region_by_coords() over arrays of coordinates"""
+        kernel = None
+        if len(self._region_ids) > NUMBA_REGION_THRESHOLD:
+            kernel = _get_nearest_region_kernel()
+        if kernel is not None:
+            idx = kernel(
+                np.ascontiguousarray(lats, dtype=np.float64),
+                np.ascontiguousarray(lons, dtype=np.float64),
+                self._region_lat, self._region_lon,
+                float(MAX_REGION_DISTANCE ** 2)
+            )
+            return np.where(idx >= 0, self._region_ids[np.maximum(idx, 0)], None)
+
+        d2 = (
+            (lats[:, None] - self._region_lat[None, :]) ** 2 +
+            (lons[:, None] - self._region_lon[None, :]) ** 2
+        )
+        idx = d2.argmin(axis=1)
+        min_distance = np.sqrt(d2[np.arange(len(lats)), idx])
+        return np.where(min_distance < MAX_REGION_DISTANCE, self._region_ids[idx], None)
+
+    def extract_labels_vectorized(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Vectorized extract_label() over a DataFrame.
+        GPS rows are labelled in one batch; the rest fall back to city lookups.
+        """
+        labels = np.full(len(df), None, dtype=object)
+
+        lats = pd.to_numeric(_column(df, 'latitude'), errors='coerce').fillna(0).to_numpy()
+        lons = pd.to_numeric(_column(df, 'longitude'), errors='coerce').fillna(0).to_numpy()
+        has_gps = (lats != 0) & (lons != 0)
+        labels[has_gps] = self.batch_nearest_region(lats[has_gps], lons[has_gps])
+
+        no_gps = df.loc[~has_gps]
+        city_labels = self.batch_region_by_city(_string_column(no_gps, 'geoip_city')).combine_first(
+            self.batch_region_by_city(_string_column(no_gps, 'asn_inferred_city'))
+        )
+        labels[~has_gps] = city_labels.astype(object).where(city_labels.notna(), None)
+
+        return labels
 
     def find_region_by_city(self, city: str) -> str:
-        """Fuzzy match city to region (simplified)"""
+        """
+        Fuzzy match city to region (simplified).
+        Matches when a region's city name appears as a whole word in `city`
+        ("Frankfurt am Main" -> eu-fra); fragments such as "York" no longer match.
+        """
         city_lower = city.lower()
-        for region_id, meta in REGION_DEFINITIONS.items():
-            if city_lower in meta['name'].lower():
-                return region_id
-        return None
+        region = self._city_to_region.get(city_lower)
+        if region:
+            return region
+        match = self._city_pattern.search(city_lower)
+        return self._city_to_region[match.group(1)] if match else None
+
+    def batch_region_by_city(self, cities: pd.Series) -> pd.Series:
+        """Vectorized find_region_by_city() over a column of city names"""
+        cities_lower = cities.str.lower()
+        exact = cities_lower.map(self._city_to_region)
+        fuzzy = cities_lower.str.extract(self._city_pattern, expand=False).map(self._city_to_region)
+        return exact.combine_first(fuzzy)
 
     def build_features(self, row: dict) -> np.ndarray:
         """
@@ -151,15 +365,11 @@ class ModelTrainer:
 
         # Suspicion level
         suspicion_level = vpn.get('suspicion_level', 'low')
-        suspicion_score = {
-            'high': 1.0,
-            'medium': 0.5,
-            'low': 0.25
-        }.get(suspicion_level, 0.0)
+        suspicion_score = _SUSPICION_MAP.get(suspicion_level, 0.0)
         features.append(suspicion_score)
 
         # Time features
-        timestamp = pd.to_datetime(row.get('timestamp', pd.Timestamp.now()))
+        timestamp = pd.to_datetime(row.get('timestamp', pd.Timestamp.now(tz='UTC')), utc=True)
         features.append(timestamp.hour / 24.0)
         features.append(timestamp.weekday() / 7.0)
 
@@ -175,33 +385,94 @@ class ModelTrainer:
         """Normalize RTT to [0, 1]"""
         return max(0.0, min(1.0, (rtt_ms - 10) / 490))
 
+    @staticmethod
+    def parse_timestamps(timestamps: pd.Series) -> pd.Series:
+        """Parse a timestamp column in one pass (UTC); missing values become now"""
+        parsed = pd.to_datetime(
+            timestamps, utc=True, errors='coerce', format='ISO8601', cache=True
+        )
+        return parsed.fillna(pd.Timestamp.now(tz='UTC'))
+
+    def extract_features_vectorized(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Build the (N, 10) feature matrix column-wise.
+        Vectorized equivalent of build_features() over a flattened DataFrame.
+        """
+        X = np.empty((len(df), FEATURE_COUNT), dtype=np.float32)
+
+        # ASN correlation features
+        X[:, 0] = np.clip(
+            (_numeric_column(df, 'asn_correlation.average_deviation') - 10) / 490, 0.0, 1.0
+        )
+        X[:, 1] = _numeric_column(df, 'asn_correlation.pattern_similarity')
+        X[:, 2] = _numeric_column(df, 'asn_correlation.matching_asns') / 50.0
+        X[:, 3] = _numeric_column(df, 'asn_correlation.visit_count') > 0
+
+        # Timezone (normalized hours)
+        X[:, 4] = np.clip(_numeric_column(df, 'timezone_offset_minutes') / 720.0, -1.0, 1.0)
+
+        # VPN detection
+        X[:, 5] = _column(df, 'vpn_detection.is_likely_vpn').fillna(False).astype(bool)
+
+        # Suspicion level (an absent key was defaulted to 'low' by flatten_nested;
+        # an explicit null scores 0, as in build_features and the C# switch)
+        X[:, 6] = _column(df, 'vpn_detection.suspicion_level').map(_SUSPICION_MAP).fillna(0.0)
+
+        # Time features
+        timestamps = self.parse_timestamps(_column(df, 'timestamp'))
+        X[:, 7] = timestamps.dt.hour.to_numpy(np.float32) / 24.0
+        X[:, 8] = timestamps.dt.weekday.to_numpy(np.float32) / 7.0
+
+        # Locale feature
+        X[:, 9] = (_string_column(df, 'locale').str.len() > 2).fillna(False).to_numpy(bool) * 0.5
+
+        return X
+
+    def prepare_chunk(self, df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """Extract float32 features and region labels from one raw chunk"""
+        df = self.flatten_nested(df)
+        labels = self.extract_labels_vectorized(df)
+        mask = pd.notna(labels)
+        return self.extract_features_vectorized(df.loc[mask]), labels[mask]
+
     def prepare_training_data(
-        self, df: pd.DataFrame
-    ) -> tuple[np.ndarray, np.ndarray, LabelEncoder]:
-        """Prepare features and labels for training"""
+        self, chunks: Iterable[pd.DataFrame]
+    ) -> tuple[np.ndarray, np.ndarray, RegionLabelEncoder]:
+        """
+        Prepare features and labels for training.
+        Only the compact feature arrays are kept between chunks.
+        """
         logger.info("Preparing training data...")
 
-        features = []
-        labels = []
-        skipped = 0
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
 
-        for _, row in df.iterrows():
-            label = self.extract_label(row)
-            if not label:
-                skipped += 1
-                continue
+        feature_parts = []
+        label_parts = []
+        total = 0
 
-            feat = self.build_features(row)
-            features.append(feat)
-            labels.append(label)
+        for chunk in chunks:
+            total += len(chunk)
+            features, labels = self.prepare_chunk(chunk)
+            feature_parts.append(features)
+            label_parts.append(labels)
 
-        X = np.array(features)
-        le = LabelEncoder()
-        y = le.fit_transform(labels)
+        if feature_parts:
+            X = np.concatenate(feature_parts)
+            labels = np.concatenate(label_parts)
+        else:
+            X = np.empty((0, FEATURE_COUNT), dtype=np.float32)
+            labels = np.empty(0, dtype=object)
+        skipped = total - len(X) + self.invalid_records
+
+        le = RegionLabelEncoder()
+        y = le.transform(labels)
 
         logger.info(f"Prepared {len(X)} samples (skipped {skipped})")
-        logger.info(f"Regions: {list(le.classes_)}")
-        logger.info(f"Sample distribution:\n{pd.Series(labels).value_counts()}")
+        logger.info(f"Regions: {le.classes_.tolist()}")
+        codes, counts = np.unique(y, return_counts=True)
+        distribution = dict(zip(le.classes_[codes].tolist(), counts.tolist()))
+        logger.info(f"Sample distribution: {distribution}")
 
         return X, y, le
 
@@ -210,15 +481,18 @@ class ModelTrainer:
         X: np.ndarray,
         y: np.ndarray,
         test_size: float = 0.2,
-        num_rounds: int = 100
+        num_rounds: int = 100,
+        num_classes: int = None
     ) -> lgb.Booster:
         """Train LightGBM classifier"""
         logger.info("Splitting data...")
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=42, stratify=y
-        )
+        # Split on indices only; each side is materialized once by fancy indexing
+        splitter = StratifiedShuffleSplit(n_splits=1, test_size=test_size, random_state=42)
+        train_idx, test_idx = next(splitter.split(np.zeros(len(y)), y))
+        X_train, X_test = X[train_idx], X[test_idx]
+        y_train, y_test = y[train_idx], y[test_idx]
 
-        num_classes = len(np.unique(y))
+        num_classes = num_classes or len(REGION_DEFINITIONS)
         logger.info(f"Training LightGBM with {num_classes} classes...")
 
         params = {
@@ -230,11 +504,27 @@ class ModelTrainer:
             'feature_fraction': 0.8,
             'bagging_fraction': 0.8,
             'bagging_freq': 5,
+            'max_bin': 63,  # Coarser histograms; ample resolution for 10 features
+            'device_type': 'cpu',
+            'num_threads': CPU_COUNT,
+            # Only 10 features: column-wise histograms avoid per-thread
+            # histogram merging, so force it rather than letting LightGBM probe
+            'force_col_wise': True,
+            'min_data_in_leaf': max(20, len(X_train) // 1000),
+            'deterministic': False,
             'verbose': -1
         }
 
-        train_data = lgb.Dataset(X_train, label=y_train)
-        test_data = lgb.Dataset(X_test, label=y_test, reference=train_data)
+        # Contiguous float32 avoids an internal copy when LightGBM bins the data
+        X_train = np.ascontiguousarray(X_train, dtype=np.float32)
+        X_test = np.ascontiguousarray(X_test, dtype=np.float32)
+
+        dataset_params = {
+            'max_bin': params['max_bin'],
+            'bin_construct_sample_cnt': min(200000, len(X_train))
+        }
+        train_data = lgb.Dataset(X_train, label=y_train, params=dataset_params)
+        test_data = lgb.Dataset(X_test, label=y_test, reference=train_data, params=dataset_params)
 
         model = lgb.train(
             params,
@@ -242,7 +532,10 @@ class ModelTrainer:
             num_boost_round=num_rounds,
             valid_sets=[test_data],
             valid_names=['test'],
-            early_stopping_rounds=10
+            callbacks=[
+                lgb.early_stopping(10, verbose=False),
+                lgb.log_evaluation(period=0)
+            ]
         )
 
         logger.info("Training complete")
@@ -252,36 +545,88 @@ class ModelTrainer:
         pred_classes = np.argmax(preds, axis=1)
 
         accuracy = accuracy_score(y_test, pred_classes)
-        top3_accuracy = top_k_accuracy_score(y_test, preds, k=min(3, num_classes))
+        top3_accuracy = top_k_accuracy_score(
+            y_test, preds, k=min(3, num_classes), labels=np.arange(num_classes)
+        )
 
         logger.info(f"Top-1 Accuracy: {accuracy:.4f}")
         logger.info(f"Top-3 Accuracy: {top3_accuracy:.4f}")
 
         return model, X_test, y_test
 
-    def export_onnx(self, model: lgb.Booster, X: np.ndarray, y: np.ndarray, le: LabelEncoder):
+    def export_onnx(self, model: lgb.Booster, X: np.ndarray, y: np.ndarray, le: RegionLabelEncoder):
         """Export LightGBM model to ONNX format"""
         logger.info("Exporting to ONNX...")
 
         try:
-            from skl2onnx.common.data_types import FloatTensorType
-
-            initial_type = [('float_input', FloatTensorType([None, X.shape[1]]))]
-            onnx_model = onnxmltools.convert_lightgbm(
-                model, initial_types=initial_type
-            )
+            onnx_model = self.convert_lightgbm(model, None, X.shape[1])
 
             model_path = self.output_dir / "inferred_region.onnx"
             onnxmltools.utils.save_model(onnx_model, str(model_path))
             logger.info(f"Saved ONNX model to {model_path}")
 
-            return model_path
+            # Same model with the input fixed to [1, feature_count], matching
+            # the C# engine's one-visit-at-a-time scoring
+            batch1_path = self.output_dir / "inferred_region.batch1.onnx"
+            onnxmltools.utils.save_model(
+                self.convert_lightgbm(model, 1, X.shape[1]), str(batch1_path)
+            )
+            logger.info(f"Saved batch-1 ONNX model to {batch1_path}")
+
+            self.model_variants = {'fp32': model_path.name, 'batch1': batch1_path.name}
         except Exception as e:
             logger.error(f"Failed to export ONNX: {e}")
             raise
 
-    def save_metadata(self, le: LabelEncoder, feature_count: int):
-        """Generate metadata JSON for ONNX model"""
+        # Optional artifact: the fp32 model is already on disk, so a failure
+        # here must not stop metadata generation
+        try:
+            ort_path = self.export_ort(model_path)
+            if ort_path:
+                self.model_variants['ort'] = ort_path.name
+        except Exception as e:
+            logger.warning(f"Skipping .ort export: {e}")
+
+        return model_path
+
+    @staticmethod
+    def convert_lightgbm(model: lgb.Booster, batch_size, feature_count: int):
+        """
+        Convert the booster to ONNX without the ZipMap node, so outputs are
+        'label' [batch] and 'probabilities' [batch, num_classes] tensors.
+        """
+        from onnxmltools.convert.common.data_types import FloatTensorType
+
+        initial_type = [('float_input', FloatTensorType([batch_size, feature_count]))]
+        onnx_model = onnxmltools.convert_lightgbm(
+            model, initial_types=initial_type, zipmap=False, target_opset=ONNX_TARGET_OPSET
+        )
+
+        onnx.checker.check_model(onnx_model)
+        return onnx_model
+
+    def export_ort(self, model_path: Path):
+        """Save an ORT-format copy with graph optimizations pre-applied (faster cold start)"""
+        if ort is None:
+            logger.info("onnxruntime not installed, skipping .ort export")
+            return None
+
+        ort_path = model_path.with_suffix('.ort')
+        options = ort.SessionOptions()
+        # ENABLE_ALL adds layout transforms tied to this machine's CPU; EXTENDED stays portable
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        options.optimized_model_filepath = str(ort_path)
+        ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+
+        logger.info(f"Saved optimized ORT model to {ort_path}")
+        return ort_path
+
+    def save_metadata(self, le: RegionLabelEncoder, feature_count: int):
+        """
+        Generate metadata JSON for ONNX model.
+        The model has no ZipMap: 'outputName' is the [batch, num_classes]
+        probability tensor, indexed by classIndexToRegionId.
+        """
         logger.info("Generating metadata...")
 
         feature_names = [
@@ -301,6 +646,9 @@ class ModelTrainer:
             f"Feature count mismatch: {len(feature_names)} != {feature_count}"
 
         metadata = {
+            'modelFile': self.model_variants.get('fp32', 'inferred_region.onnx'),
+            'modelVariants': self.model_variants,
+            'outputName': 'probabilities',
             'featureCount': feature_count,
             'featureNames': feature_names,
             'classIndexToRegionId': {
@@ -325,16 +673,23 @@ class ModelTrainer:
 
         logger.info(f"Saved metadata to {metadata_path}")
 
-    def run(self, input_file: str, test_size: float = 0.2, num_rounds: int = 100):
+    def run(
+        self,
+        input_file: str,
+        test_size: float = 0.2,
+        num_rounds: int = 100,
+        chunk_size: int = CHUNK_SIZE
+    ):
         """End-to-end training pipeline"""
-        df = self.load_data(input_file)
-        X, y, le = self.prepare_training_data(df)
+        X, y, le = self.prepare_training_data(self.iter_data(input_file, chunk_size))
 
         if len(X) < 50:
             logger.error("Not enough samples for training")
             return False
 
-        model, X_test, y_test = self.train(X, y, test_size=test_size, num_rounds=num_rounds)
+        model, X_test, y_test = self.train(
+            X, y, test_size=test_size, num_rounds=num_rounds, num_classes=len(le.classes_)
+        )
         self.export_onnx(model, X, y, le)
         self.save_metadata(le, X.shape[1])
 
@@ -350,6 +705,7 @@ def main():
     parser.add_argument('--output', required=True, help='Output directory for ONNX model')
     parser.add_argument('--test-size', type=float, default=0.2, help='Test set fraction')
     parser.add_argument('--num-rounds', type=int, default=100, help='LightGBM boosting rounds')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='NDJSON lines per chunk')
 
     args = parser.parse_args()
 
@@ -357,7 +713,8 @@ def main():
     success = trainer.run(
         input_file=args.input,
         test_size=args.test_size,
-        num_rounds=args.num_rounds
+        num_rounds=args.num_rounds,
+        chunk_size=args.chunk_size
     )
 
     return 0 if success else 1
@@ -4,33 +4,46 @@ import base64
 import time
 import uuid
 import sys
+from functools import lru_cache
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.backends import default_backend
 
-def compute_sha384_hash(data):
-    return base64.b64encode(hashlib.sha384(data.encode('utf-8')).digest()).decode('utf-8')
+ECDSA_SHA384 = ec.ECDSA(hashes.SHA384())
 
-def sign_request(private_key_der_base64, method, path, body, timestamp, nonce):
-    # Decode private key
-    private_key_bytes = base64.b64decode(private_key_der_base64)
-    private_key = serialization.load_der_private_key(
-        private_key_bytes,
+@lru_cache(maxsize=8)
+def _load_key(private_key_der_base64):
+    # Parse the DER key once per distinct key string
+    return serialization.load_der_private_key(
+        base64.b64decode(private_key_der_base64),
         password=None,
         backend=default_backend()
     )
+
+def compute_sha384_hash(data):
+    # Accept bytes directly so callers holding raw bodies skip an encode/copy
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return base64.b64encode(hashlib.sha384(data).digest()).decode('ascii')
+
+def sign_request(private_key_der_base64, method, path, body, timestamp, nonce):
+    # Decode private key (cached)
+    private_key = _load_key(private_key_der_base64)
     
     # Compute body hash
     body_hash = compute_sha384_hash(body) if body else ""
     
     # Create message: method|path|bodyHash|timestamp|nonce
-    message = f"{method}|{path}|{body_hash}|{timestamp}|{nonce}"
+    message = b'|'.join([
+        method.encode('utf-8'),
+        path.encode('utf-8'),
+        body_hash.encode('ascii'),
+        str(timestamp).encode('ascii'),
+        nonce.encode('utf-8')
+    ])
     
     # Sign with ECDSA P-384
-    signature = private_key.sign(
-        message.encode('utf-8'),
-        ec.ECDSA(hashes.SHA384())
-    )
+    signature = private_key.sign(message, ECDSA_SHA384)
     
     return base64.b64encode(signature).decode('utf-8')
 
@@ -42,7 +55,7 @@ if __name__ == "__main__":
     private_key = sys.argv[1]
     method = sys.argv[2]
     path = sys.argv[3]
-    body = sys.argv[4]
+    body = sys.argv[4].encode('utf-8')
     timestamp = int(sys.argv[5])
     nonce = sys.argv[6]
     